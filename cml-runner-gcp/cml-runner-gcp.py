@@ -1,12 +1,75 @@
 #!/usr/bin/env python
 
 import argparse
+import functools
 import gitlab
+import google.auth
 import googleapiclient.discovery
+import googleapiclient.errors
 import json
 import os
+import textwrap
 import time
-from typing import Dict, Optional, Text, Union
+from typing import Dict, List, Optional, Text, Tuple, Union
+
+
+# Max time to wait for a zone operation, in seconds
+OPERATION_TIMEOUT = 300
+
+# GitLab runners registration tokens are cached on disk per project
+REGISTRATION_TOKEN_CACHE_DIR = os.path.expanduser('~/.cache/cml')
+REGISTRATION_TOKEN_CACHE_TTL = 3600
+
+# Static blocks of instance startup script
+STARTUP_SETTINGS = textwrap.dedent('''\
+    export DEBIAN_FRONTEND=noninteractive
+    echo 'APT::Get::Assume-Yes "true";' | sudo tee -a /etc/apt/apt.conf.d/90assumeyes
+''')
+INSTALL_DOCKER = textwrap.dedent('''\
+    if ! which docker > /dev/null; then
+        echo "Install Docker"
+        sudo curl -fsSL https://get.docker.com -o get-docker.sh && sudo sh get-docker.sh
+        sudo usermod -aG docker ubuntu
+        sudo chmod 666 /var/run/docker.sock
+    fi
+''')
+INSTALL_GITLAB_RUNNER = textwrap.dedent('''\
+    if ! which gitlab-runner > /dev/null; then
+        echo "Install GitLab runner"
+        curl -LJO "https://gitlab-runner-downloads.s3.amazonaws.com/latest/deb/gitlab-runner_amd64.deb"
+        yes | sudo dpkg -i gitlab-runner_amd64.deb
+    fi
+''')
+INSTALL_GCSFUSE = textwrap.dedent('''\
+    if ! which gcsfuse > /dev/null; then
+        export GCSFUSE_REPO=gcsfuse-`lsb_release -c -s`
+        echo "deb http://packages.cloud.google.com/apt $GCSFUSE_REPO main" | sudo tee /etc/apt/sources.list.d/gcsfuse.list
+        curl https://packages.cloud.google.com/apt/doc/apt-key.gpg | sudo apt-key add -
+
+        sudo apt-get update
+        sudo apt-get install -y gcsfuse
+    fi
+''')
+RUN_GITLAB_RUNNER = textwrap.dedent('''\
+    sudo gitlab-runner status
+
+    if [ $? -ne 0 ]; then
+        sudo gitlab-runner start
+    fi
+''')
+
+
+@functools.lru_cache(maxsize=None)
+def _compute_service() -> object:
+    """Build Compute API client once and share it between instances.
+
+    Discovery document is loaded from the copy bundled with
+    google-api-python-client instead of being fetched over the network.
+    """
+
+    return googleapiclient.discovery.build(
+        'compute', 'v1', cache_discovery=False, static_discovery=True
+    )
 
 
 class GCEInstance:
@@ -19,7 +82,10 @@ class GCEInstance:
             machine_type: Text,
             bucket: Optional[Text] = None,
             bucket_mount_path: Optional[Text] = None,
-            startup_script: Optional[Text] = None
+            startup_script: Optional[Text] = None,
+            preemptible: bool = True,
+            termination_action: Text = 'STOP',
+            max_run_duration: Optional[int] = None
 
     ) -> None:
 
@@ -30,21 +96,148 @@ class GCEInstance:
         self.bucket = bucket
         self.bucket_mount_path = bucket_mount_path
         self.startup_script = startup_script
+        self.preemptible = preemptible
+        self.termination_action = termination_action
+        self.max_run_duration = max_run_duration
 
-        self.compute = googleapiclient.discovery.build('compute', 'v1')
+        self.compute = _compute_service()
         # TODO: add statuses Enum
-        self.status = None
+        # Status is requested on first access: stop/delete don't need it
+        self._status = None
+
+    @property
+    def status(self) -> Text:
+
+        if self._status is None:
+            self._get_status()
 
-        self._get_status()
+        return self._status
 
     def create(self) -> object:
+
+        config = self._instance_properties()
+        config['name'] = self.machine_name
+        config['machineType'] = (
+            f'zones/{self.zone}/machineTypes/{self.machine_type}'
+        )
+
+        return self.compute.instances().insert(
+            project=self.project,
+            zone=self.zone,
+            body=config
+        ).execute()
+
+    @staticmethod
+    def bulk_create(instances: List['GCEInstance']) -> object:
+        """Create instances with a single bulkInsert request.
+
+        All instances get the configuration (project, zone, machine type,
+        startup script) of the first one; only the names differ.
+        """
+
+        first = instances[0]
+
+        return first.compute.instances().bulkInsert(
+            project=first.project,
+            zone=first.zone,
+            body={
+                'count': len(instances),
+                'instanceProperties': first._instance_properties(),
+                'perInstanceProperties': {
+                    instance.machine_name: {} for instance in instances
+                }
+            }
+        ).execute()
+
+    @staticmethod
+    def batch(
+            instances: List['GCEInstance'],
+            action: Text
+    ) -> Tuple[List[Tuple['GCEInstance', Dict]], List[Exception]]:
+        """Run start/stop/delete for instances in one batch HTTP request.
+
+        Returns (instance, operation) pairs of started operations and
+        errors of failed requests, so that started operations can still
+        be finished before the errors are raised.
+        """
+
+        operations = {}
+        errors = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                operations[request_id] = response
+
+        batch = instances[0].compute.new_batch_http_request(callback=callback)
+
+        for instance in instances:
+            batch.add(
+                getattr(instance.compute.instances(), action)(
+                    project=instance.project,
+                    zone=instance.zone,
+                    instance=instance.machine_name
+                ),
+                request_id=instance.machine_name
+            )
+
+        batch.execute()
+
+        started = [
+            (instance, operations[instance.machine_name])
+            for instance in instances
+            if instance.machine_name in operations
+        ]
+
+        return started, errors
+
+    def start(self) -> object:
+        return self.compute.instances().start(
+            project=self.project,
+            zone=self.zone,
+            instance=self.machine_name
+        ).execute()
+
+    def stop(self) -> object:
+        return self.compute.instances().stop(
+            project=self.project,
+            zone=self.zone,
+            instance=self.machine_name
+        ).execute()
+
+    def delete(self) -> object:
+        return self.compute.instances().delete(
+            project=self.project,
+            zone=self.zone,
+            instance=self.machine_name
+        ).execute()
+
+    def wait_for_operation(self, operation_name: Text) -> Dict:
+
+        print('Waiting for operation to finish...')
+
+        return _wait_operation(
+            self.compute, self.project, self.zone, operation_name
+        )
+
+    def exists(self) -> bool:
+
+        if self.status in ['RUNNING', 'TERMINATED']:
+            return True
+
+        return False
+
+    def set_startup_script(self, startup_script) -> None:
+        self.startup_script = startup_script
+
+    def _instance_properties(self) -> Dict:
         # Get ubuntu image
         image_response = self.compute.images().getFromFamily(
             project='ubuntu-os-cloud', family='ubuntu-2004-lts'
         ).execute()
         source_disk_image = image_response['selfLink']
         # Configure the machine
-        machine_type = f'zones/{self.zone}/machineTypes/{self.machine_type}'
         metadata_items = []
 
         if self.startup_script:
@@ -55,9 +248,26 @@ class GCEInstance:
                 'value': self.startup_script
             })
 
-        config = {
-            'name': self.machine_name,
-            'machineType': machine_type,
+        scheduling = {}
+
+        if self.preemptible:
+            # Spot instances are cheaper and start faster
+            scheduling.update({
+                'preemptible': True,
+                'provisioningModel': 'SPOT',
+                'automaticRestart': False,
+                'onHostMaintenance': 'TERMINATE'
+            })
+
+        if self.max_run_duration:
+            scheduling['maxRunDuration'] = {'seconds': self.max_run_duration}
+
+        if scheduling:
+            # Action on preemption or when max run duration is reached
+            scheduling['instanceTerminationAction'] = self.termination_action
+
+        return {
+            'machineType': self.machine_type,
 
             # Specify the boot disk and the image to use as a source.
             'disks': [
@@ -85,93 +295,92 @@ class GCEInstance:
             }],
             # Metadata is readable from the instance and allows you to
             # pass configuration from deployment scripts to instances.
-            'metadata': {'items': metadata_items}
+            'metadata': {'items': metadata_items},
+            'scheduling': scheduling
         }
 
-        return self.compute.instances().insert(
-            project=self.project,
-            zone=self.zone,
-            body=config
-        ).execute()
-
-    def start(self) -> object:
-        return self.compute.instances().start(
-            project=self.project,
-            zone=self.zone,
-            instance=self.machine_name
-        ).execute()
-
-    def stop(self) -> object:
-        return self.compute.instances().stop(
-            project=self.project,
-            zone=self.zone,
-            instance=self.machine_name
-        ).execute()
-
-    def delete(self) -> object:
-        return self.compute.instances().delete(
-            project=self.project,
-            zone=self.zone,
-            instance=self.machine_name
-        ).execute()
-
-    def wait_for_operation(self, operation_name: Text) -> None:
-
-        print('Waiting for operation to finish...')
-
-        while True:
+    def _get_status(self) -> None:
 
-            result = self.compute.zoneOperations().get(
+        try:
+            # Request only the status field (partial response)
+            instance = self.compute.instances().get(
                 project=self.project,
                 zone=self.zone,
-                operation=operation_name
+                instance=self.machine_name,
+                fields='status'
             ).execute()
+        except googleapiclient.errors.HttpError as e:
+            # If instance with specified name does not exist then create it
+            if e.resp.status == 404:
+                self._status = 'NONEXISTENT'
+                return
+            raise
+
+        # Check if the instance is stopped. If yes - run it
+        self._status = instance['status']
+
+
+def _wait_operation(
+        compute: object,
+        project: Text,
+        zone: Text,
+        operation_name: Text,
+        timeout: float = OPERATION_TIMEOUT
+) -> Dict:
+    """Wait for zone operation to finish.
+
+    zoneOperations().wait holds the request on server side until the
+    operation is done or for up to 2 minutes, so no client side sleep is
+    needed. Timeout is checked before each call: a call started just
+    before the deadline may still return up to 2 minutes later.
+    """
+
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+
+        result = compute.zoneOperations().wait(
+            project=project,
+            zone=zone,
+            operation=operation_name
+        ).execute()
 
-            if result['status'] == 'DONE':
-
-                print("done.")
-
-                if 'error' in result:
-                    raise Exception(result['error'])
+        if result['status'] == 'DONE':
 
-                return result
+            print("done.")
 
-            time.sleep(1)
+            if 'error' in result:
+                raise Exception(result['error'])
 
-    def exists(self) -> bool:
+            return result
 
-        if self.status in ['RUNNING', 'TERMINATED']:
-            return True
+    raise TimeoutError(
+        f'Operation {operation_name} not finished in {timeout} seconds'
+    )
 
-        return False
 
-    def set_startup_script(self, startup_script) -> None:
-        self.startup_script = startup_script
+def _finish_operations(
+        operations: List[Tuple['GCEInstance', Dict]],
+        wait: bool = True,
+        errors: Optional[List[Exception]] = None
+) -> None:
 
-    def _get_status(self) -> None:
+    for instance, operation in operations:
 
-        instances = self._list_instances()
-        # If instance with specified name does not exist then create it
-        if self.machine_name not in instances:
-            self.status = 'NONEXISTENT'
+        if wait:
+            instance.wait_for_operation(operation['name'])
         else:
-            # Check if the instance is stopped. If yes - run it
-            self.status = instances[self.machine_name]['status']
-
-    def _list_instances(self) -> Dict[Text, Dict]:
+            # Operation runs on GCE side; its status can be checked later
+            print(f"Started operation {operation['name']} "
+                  f"for instance {instance.machine_name}.")
 
-        result = self.compute.instances().list(
-            project=self.project, zone=self.zone
-        ).execute()
-        instances = {}
+    # Errors of failed requests are raised after started operations finish
+    if errors:
 
-        if 'items' in result:
+        if len(errors) == 1:
+            raise errors[0]
 
-            for item in result['items']:
-                instance_name = item.pop('name')
-                instances[instance_name] = item
-
-        return instances
+        raise Exception('; '.join(str(error) for error in errors))
 
 
 class GitlabRunner:
@@ -198,46 +407,78 @@ class GitlabRunner:
 
         reg_token = self._registration_token()
 
-        register_gitlab_runner = f'''
-        # Verify runner
-        sudo gitlab-runner verify --name {self.name}
-
-        if  [ $? -ne 0 ]; then
-            # Unregister old 
-            gitlab-runner unregister --name {self.name}
-
-            gitlab-runner register \
-                --non-interactive \
-                --name={self.name} \
-                -u https://gitlab.com/ \
-                -r {reg_token} \
-                --tag-list {self.tags} \
-                --executor docker \
-                --docker-devices /dev/fuse \
-                --docker-privileged '''
+        register_args = [
+            'gitlab-runner register',
+            '--non-interactive',
+            f'--name={self.name}',
+            '-u https://gitlab.com/',
+            f'-r {reg_token}',
+            f'--tag-list {self.tags}',
+            '--executor docker',
+            '--docker-devices /dev/fuse',
+            '--docker-privileged'
+        ]
 
         if self.default_image:
-            register_gitlab_runner += f'''\
-            --docker-image {self.default_image} '''
+            register_args.append(f'--docker-image {self.default_image}')
 
         if self.volumes:
             for volume in self.volumes.split(','):
-                register_gitlab_runner += f'''\
-                --docker-volumes {volume} '''
+                register_args.append(f'--docker-volumes {volume}')
+
+        lines = [
+            '# Verify runner',
+            f'sudo gitlab-runner verify --name {self.name}',
+            '',
+            'if [ $? -ne 0 ]; then',
+            '    # Unregister old',
+            f'    gitlab-runner unregister --name {self.name}',
+            '',
+            '    ' + ' \\\n        '.join(register_args),
+            'fi',
+            ''
+        ]
+
+        return '\n'.join(lines)
+
+    def _registration_token(self) -> Text:
+
+        cache_path = os.path.join(
+            REGISTRATION_TOKEN_CACHE_DIR, f'{self.project_id}.json'
+        )
 
-        register_gitlab_runner += f'''
-        fi
-        '''
+        try:
+            with open(cache_path) as cache_f:
+                cache = json.load(cache_f)
 
-        return register_gitlab_runner
+            if cache['expires_at'] > time.time():
+                return cache['token']
 
-    def _registration_token(self):
+        except (OSError, ValueError, KeyError):
+            pass
 
         gl = gitlab.Gitlab('https://gitlab.com', private_token=self.access_token)
         gl.auth()
         project = gl.projects.get(self.project_id)
+        token = project.attributes['runners_token']
+
+        try:
+            os.makedirs(REGISTRATION_TOKEN_CACHE_DIR, exist_ok=True)
+            # Token is a secret: cache file is readable by owner only
+            cache_fd = os.open(
+                cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+
+            with os.fdopen(cache_fd, 'w') as cache_f:
+                json.dump({
+                    'token': token,
+                    'expires_at': time.time() + REGISTRATION_TOKEN_CACHE_TTL
+                }, cache_f)
 
-        return project.attributes['runners_token']
+        except OSError:
+            pass
+
+        return token
 
 
 class CMLDeployment:
@@ -251,96 +492,98 @@ class CMLDeployment:
         self.instance = instance
         self.runner = runner
 
-    def deploy(self) -> None:
+    def deploy(self, wait: bool = True) -> None:
+
+        operation = self.launch()
+
+        if operation:
+            _finish_operations([(self.instance, operation)], wait)
+
+    def launch(self) -> Optional[Dict]:
+        """Create or start instance without waiting for the operation."""
 
         # If instance with specified name does not exist then create it
         if not self.instance.exists():
 
-            print('Creating instance.')
+            print(f'Creating instance {self.instance.machine_name}.')
             startup_script = self._build_startup_script()
             self.instance.set_startup_script(startup_script)
-            operation = self.instance.create()
-            self.instance.wait_for_operation(operation['name'])
 
-        else:
+            return self.instance.create()
 
-            print('Starting instance.')
+        print(f'Starting instance {self.instance.machine_name}.')
 
-            if self.instance.status == 'TERMINATED':
-                operation = self.instance.start()
-                self.instance.wait_for_operation(operation['name'])
+        if self.instance.status == 'TERMINATED':
+            return self.instance.start()
 
-    def _build_startup_script(self) -> Text:
+        return None
 
-        header = '#!/bin/sh'
-        settings = '''
-        export DEBIAN_FRONTEND=noninteractive
-        echo "APT::Get::Assume-Yes \"true\";" | sudo tee -a /etc/apt/apt.conf.d/90assumeyes
-        '''
-        install_docker = '''
-        if ! which docker > /dev/null; then
-            echo "Install Docker"
-            sudo curl -fsSL https://get.docker.com -o get-docker.sh && sudo sh get-docker.sh
-            sudo usermod -aG docker ubuntu
-            sudo chmod 666 /var/run/docker.sock
-        fi
-        '''
-        install_gitlab_runner = '''
-        if ! which gitlab-runner > /dev/null; then
-            echo "Install GitLab runner"
-            curl -LJO "https://gitlab-runner-downloads.s3.amazonaws.com/latest/deb/gitlab-runner_amd64.deb"
-            yes | sudo dpkg -i gitlab-runner_amd64.deb
-        fi
-        '''
-        register_gitlab_runner = self.runner.registration_command()
-
-        install_gcsfuse = '''
-        if ! which gcsfuse > /dev/null; then
-            export GCSFUSE_REPO=gcsfuse-`lsb_release -c -s`
-            echo "deb http://packages.cloud.google.com/apt $GCSFUSE_REPO main" | sudo tee /etc/apt/sources.list.d/gcsfuse.list
-            curl https://packages.cloud.google.com/apt/doc/apt-key.gpg | sudo apt-key add -
-
-            sudo apt-get update
-            sudo apt-get install -y gcsfuse
-        fi
-        '''
-
-        mount_bucket = ''
-        bucket = self.instance.bucket
-        mount_path = self.instance.bucket_mount_path
+    @staticmethod
+    def deploy_many(
+            deployments: List['CMLDeployment'],
+            wait: bool = True
+    ) -> None:
+        """Create/start all instances, then wait for their operations.
 
-        if bucket and mount_path:
-            mount_bucket = f'''
-            sudo mkdir -p {mount_path}
-            sudo gcsfuse {bucket} {mount_path} '''
+        Missing instances are created with one bulkInsert request and
+        stopped ones are started with one batch HTTP request. GCE runs the
+        operations concurrently, so waiting for N instances takes about as
+        long as waiting for the slowest one. Deployments are expected to
+        share instance and runner settings apart from the machine name.
+        """
+
+        if len(deployments) == 1:
+            deployments[0].deploy(wait)
+            return
+
+        instances = [deployment.instance for deployment in deployments]
+        to_create = [i for i in instances if not i.exists()]
+        to_start = [i for i in instances if i.status == 'TERMINATED']
+        operations = []
+        errors = []
 
-        run_runner = '''
-        sudo gitlab-runner status
+        if to_create:
 
-        if  [ $? -ne 0 ]; then
-            sudo gitlab-runner start
-        fi
-        '''
+            names = ', '.join(i.machine_name for i in to_create)
+            print(f'Creating instances {names}.')
+            startup_script = deployments[0]._build_startup_script()
 
-        startup_script = f'''
-        {header}
+            for instance in to_create:
+                instance.set_startup_script(startup_script)
 
-        {settings}
+            operation = GCEInstance.bulk_create(to_create)
+            operations.append((to_create[0], operation))
 
-        {install_docker}
+        if to_start:
 
-        {install_gitlab_runner}
+            names = ', '.join(i.machine_name for i in to_start)
+            print(f'Starting instances {names}.')
+            started, errors = GCEInstance.batch(to_start, 'start')
+            operations.extend(started)
 
-        {register_gitlab_runner}
+        _finish_operations(operations, wait, errors)
+
+    def _build_startup_script(self) -> Text:
 
-        {install_gcsfuse}
+        parts = [
+            '#!/bin/sh',
+            STARTUP_SETTINGS,
+            INSTALL_DOCKER,
+            INSTALL_GITLAB_RUNNER,
+            self.runner.registration_command(),
+            INSTALL_GCSFUSE
+        ]
 
-        {mount_bucket}
+        bucket = self.instance.bucket
+        mount_path = self.instance.bucket_mount_path
+
+        if bucket and mount_path:
+            parts.append(f'sudo mkdir -p {mount_path}')
+            parts.append(f'sudo gcsfuse {bucket} {mount_path}\n')
 
-        {run_runner}
-        '''
+        parts.append(RUN_GITLAB_RUNNER)
 
-        return startup_script
+        return '\n'.join(parts)
 
 
 def get_parser():
@@ -350,6 +593,12 @@ def get_parser():
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     parser.add_argument('action', choices=['deploy', 'stop', 'delete'])
+    parser.add_argument(
+        '--no-wait',
+        dest='no_wait',
+        action='store_true',
+        help='Do not wait for instance operations to finish.'
+    )
     parser.add_argument(
         '--gcp-zone',
         dest='gcp_zone',
@@ -360,7 +609,7 @@ def get_parser():
         '--gcp-machine-name',
         dest='gcp_machine_name',
         default='cml-vm',
-        help='New instance name.'
+        help='New instance name (comma separated list for several instances).'
     )
     parser.add_argument(
         '--gcp-machine-type',
@@ -368,6 +617,33 @@ def get_parser():
         default='f1-micro',
         help='Compute Engine machine type'
     )
+    parser.add_argument(
+        '--gcp-preemptible',
+        dest='gcp_preemptible',
+        action='store_true',
+        help='Create preemptible (Spot) instance (default).'
+    )
+    parser.add_argument(
+        '--gcp-no-preemptible',
+        dest='gcp_preemptible',
+        action='store_false',
+        help='Create regular (not preemptible) instance.'
+    )
+    parser.set_defaults(gcp_preemptible=True)
+    parser.add_argument(
+        '--gcp-termination-action',
+        dest='gcp_termination_action',
+        choices=['STOP', 'DELETE'],
+        default='STOP',
+        help='Action on instance preemption or max run duration end.'
+    )
+    parser.add_argument(
+        '--gcp-max-run-duration',
+        dest='gcp_max_run_duration',
+        type=int,
+        default=None,
+        help='Max instance run duration in seconds.'
+    )
     parser.add_argument(
         '--gcp-bucket',
         dest='gcp_bucket',
@@ -425,22 +701,27 @@ def main():
     args_parser = get_parser()
     args = args_parser.parse_args()
 
-    if not os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
-        raise EnvironmentError(f'Environment variable GOOGLE_APPLICATION_CREDENTIALS not defined')
-
-    with open(os.getenv('GOOGLE_APPLICATION_CREDENTIALS')) as gac_f:
-        gac = json.load(gac_f)
-
-    gcp_project = gac['project_id']
-
-    instance = GCEInstance(
-        project=gcp_project,
-        zone=args.gcp_zone,
-        machine_name=args.gcp_machine_name,
-        machine_type=args.gcp_machine_type,
-        bucket=args.gcp_bucket,
-        bucket_mount_path=args.gcp_bucket_mount_path
-    )
+    # Project of application default credentials: service account key from
+    # GOOGLE_APPLICATION_CREDENTIALS, gcloud config or GCE metadata server
+    _, gcp_project = google.auth.default()
+
+    if not gcp_project:
+        raise EnvironmentError('GCP project not found in application default credentials')
+
+    instances = [
+        GCEInstance(
+            project=gcp_project,
+            zone=args.gcp_zone,
+            machine_name=machine_name,
+            machine_type=args.gcp_machine_type,
+            bucket=args.gcp_bucket,
+            bucket_mount_path=args.gcp_bucket_mount_path,
+            preemptible=args.gcp_preemptible,
+            termination_action=args.gcp_termination_action,
+            max_run_duration=args.gcp_max_run_duration
+        )
+        for machine_name in args.gcp_machine_name.split(',')
+    ]
 
     if args.action == 'deploy':
 
@@ -452,20 +733,25 @@ def main():
             default_image=args.gitlab_runner_default_image,
             volumes=args.gitlab_runner_volumes
         )
-        cml_deployment = CMLDeployment(instance=instance, runner=runner)
-        cml_deployment.deploy()
+        CMLDeployment.deploy_many(
+            [
+                CMLDeployment(instance=instance, runner=runner)
+                for instance in instances
+            ],
+            wait=not args.no_wait
+        )
 
     elif args.action == 'stop':
 
-        print('Stopping instance')
-        operation = instance.stop()
-        instance.wait_for_operation(operation['name'])
+        print('Stopping instances')
+        operations, errors = GCEInstance.batch(instances, 'stop')
+        _finish_operations(operations, wait=not args.no_wait, errors=errors)
 
     elif args.action == 'delete':
 
-        print('Deleting instance')
-        operation = instance.delete()
-        instance.wait_for_operation(operation['name'])
+        print('Deleting instances')
+        operations, errors = GCEInstance.batch(instances, 'delete')
+        _finish_operations(operations, wait=not args.no_wait, errors=errors)
 
     else:
         raise ValueError(f'Invalid action {args.action}')
@@ -1,11 +1,149 @@
+import io
 import joblib
 import os
+import queue
+import threading
+import time
 import numpy as np
-from flask import Flask, jsonify, request
+import orjson
+from flask import Flask, request
+from werkzeug.exceptions import BadRequest, ServiceUnavailable
+
+
+USE_ONNX = os.getenv('USE_ONNX', '0') == '1'
+
+
+class OnnxModel:
+    """sklearn model compiled to ONNX and run with ONNX Runtime.
+
+    Requires optional packages skl2onnx and onnxruntime.
+    """
+
+    def __init__(self, model):
+
+        from onnxruntime import InferenceSession
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+
+        onnx_model = convert_sklearn(
+            model,
+            initial_types=[
+                ('input', FloatTensorType([None, model.n_features_in_]))
+            ]
+        )
+        self.session = InferenceSession(
+            onnx_model.SerializeToString(),
+            providers=['CPUExecutionProvider']
+        )
+        # First output is labels for classifiers and values for regressors;
+        # fetch only it to skip computing probabilities
+        self.output_name = self.session.get_outputs()[0].name
+
+    def predict(self, X):
+
+        inputs = {'input': X.astype(np.float32, copy=False)}
+        predictions = self.session.run([self.output_name], inputs)[0]
+
+        if predictions.ndim == 2 and predictions.shape[1] == 1:
+            predictions = predictions.ravel()
+
+        return predictions
+
+
+def load_model(path):
+
+    # Memory-map model arrays instead of copying them into process memory:
+    # loading is faster and the OS page cache is shared between reloads
+    model = joblib.load(path, mmap_mode='r')
+
+    if USE_ONNX:
+        try:
+            return OnnxModel(model)
+        except Exception as e:
+            print(f'Failed to convert model to ONNX, use sklearn: {e}')
+
+    return model
 
 
 model_path = os.getenv('MODEL_PATH')
-model = joblib.load(model_path)
+model = load_model(model_path)
+model_lock = threading.Lock()
+
+# Concurrent /predict requests are joined into a single model.predict call
+MAX_BATCH = int(os.getenv('MAX_BATCH', 64))
+MAX_WAIT_MS = float(os.getenv('MAX_WAIT_MS', 5))
+PREDICT_TIMEOUT = float(os.getenv('PREDICT_TIMEOUT', 30))
+# Tree based models predict on float32, so float32 input saves a conversion.
+# If not set, numpy infers dtype (keeps string features for encoders)
+INPUT_DTYPE = np.dtype(os.getenv('INPUT_DTYPE')) if os.getenv('INPUT_DTYPE') else None
+predict_queue = queue.Queue()
+
+
+def run_batch(items):
+
+    arrays = [item[0] for item in items]
+
+    try:
+        predictions = model.predict(np.concatenate(arrays))
+        offsets = np.cumsum([len(array) for array in arrays])[:-1]
+        results = [(p, None) for p in np.split(predictions, offsets)]
+    except Exception:
+        # Incompatible requests (bad data, different number of features)
+        # can't share a batch: predict them one by one
+        results = []
+        for array in arrays:
+            try:
+                results.append((model.predict(array), None))
+            except Exception as e:
+                results.append((None, e))
+
+    for (_, event, slot), (result, error) in zip(items, results):
+        slot['result'] = result
+        slot['error'] = error
+        event.set()
+
+
+def batcher():
+
+    while True:
+        # Keep the thread alive on unexpected errors, otherwise all
+        # following /predict requests would wait for results forever
+        try:
+            collect_and_run_batch()
+        except Exception as e:
+            print(f'Predict batcher error: {e}')
+
+
+def collect_and_run_batch():
+
+    items = [predict_queue.get()]
+    deadline = time.monotonic() + MAX_WAIT_MS / 1000
+
+    while len(items) < MAX_BATCH:
+
+        timeout = deadline - time.monotonic()
+
+        if timeout <= 0:
+            break
+
+        try:
+            items.append(predict_queue.get(timeout=timeout))
+        except queue.Empty:
+            break
+
+    try:
+        run_batch(items)
+    except Exception as e:
+        # Don't leave requests of the failed batch waiting
+        for _, event, slot in items:
+            if not event.is_set():
+                slot['result'] = None
+                slot['error'] = e
+                event.set()
+        raise
+
+
+threading.Thread(target=batcher, daemon=True).start()
 
 app = Flask(__name__)
 
@@ -21,7 +159,9 @@ def reload_model():
     global model
     global model_path
 
-    model = joblib.load(model_path)
+    # Serialize reloads; requests in progress keep the old model until done
+    with model_lock:
+        model = load_model(model_path)
 
     return 'Model reloaded'
 
@@ -29,15 +169,52 @@ def reload_model():
 @app.route('/predict', methods=['POST'])
 def predict():
 
-    data = request.get_json(force=True)
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError as e:
+        raise BadRequest(f'Failed to decode JSON object: {e}')
+
     predict_request = data['data']
-    predict_request = np.array(predict_request)
-    predict_request = model.predict(predict_request)
+    predict_request = np.asarray(predict_request, dtype=INPUT_DTYPE)
+
+    event = threading.Event()
+    slot = {}
+    predict_queue.put((predict_request, event, slot))
+
+    if not event.wait(PREDICT_TIMEOUT):
+        raise ServiceUnavailable('Prediction timed out')
+
+    if slot['error'] is not None:
+        raise slot['error']
+
+    predict_request = slot['result']
+
+    # Send predictions in numpy .npy format without converting to Python lists
+    accept = request.accept_mimetypes.best_match(
+        ['application/json', 'application/octet-stream']
+    )
+
+    if accept == 'application/octet-stream':
+
+        # Object arrays (e.g. string labels) would be pickled inside .npy:
+        # convert them to a fixed width dtype so clients never unpickle
+        if predict_request.dtype == object:
+            predict_request = np.asarray(predict_request.tolist())
+
+        # Arrays which can't be converted are sent as JSON
+        if predict_request.dtype != object:
+            buffer = io.BytesIO()
+            np.save(buffer, predict_request, allow_pickle=False)
+            return app.response_class(
+                buffer.getvalue(), mimetype='application/octet-stream'
+            )
+
     output = {'predictions': predict_request.tolist()}
 
-    return jsonify(output)
+    return app.response_class(orjson.dumps(output), mimetype='application/json')
 
 
 if __name__ == '__main__':
 
-    app.run(host='0.0.0.0', port=9000, debug=True)
+    # Development server; the docker image runs the app with gunicorn
+    app.run(host='0.0.0.0', port=9000)